@@ -1,10 +1,63 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import requests
-import tempfile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import io
+import wave
+import hashlib
+import orjson
+import time
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-def transcribe_with_deepgram(audio_file_path, api_key, language="en-US"):
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "speechapp")
+RACE_SERVICE = "Fastest (race both)"
+CHUNK_SECONDS = 30
+RETRY_AFTER_MAX = 1
+# Les messages d'erreur commencent toujours par l'un de ces préfixes:
+# FAILURE_PREFIX pour un échec, NO_SPEECH pour un audio sans parole.
+FAILURE_PREFIX = "❌"
+NO_SPEECH = "No speech detected"
+ERROR_PREFIXES = (FAILURE_PREFIX, NO_SPEECH)
+
+class _CappedRetry(Retry):
+    # Un Retry-After de plusieurs minutes bloquerait l'interface: on le plafonne.
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+@st.cache_resource
+def _http_session():
+    # Une seule session partagée: les transcriptions successives réutilisent
+    # la même connexion keep-alive au lieu de refaire un handshake TLS.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # Les POST facturés ne sont rejoués que si la connexion a échoué ou si
+        # le service a répondu 429/5xx: jamais après un timeout de lecture.
+        max_retries=_CappedRetry(
+            total=2,
+            connect=2,
+            read=0,
+            status=2,
+            backoff_factor=0.3,
+            backoff_max=2,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=None,
+            raise_on_status=False
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+def transcribe_with_deepgram(audio_data, api_key, language="en-US"):
     if not api_key:
         return "❌ Deepgram API key not configured"
     
@@ -13,60 +66,331 @@ def transcribe_with_deepgram(audio_file_path, api_key, language="en-US"):
         headers = {"Authorization": f"Token {api_key}"}
         params = {"language": language, "punctuate": "true"}
 
-        with open(audio_file_path, 'rb') as audio_file:
-            response = requests.post(url, headers=headers, params=params, data=audio_file, timeout=30)
+        response = _http_session().post(url, headers=headers, params=params, data=audio_data, timeout=30)
         
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             transcript = result['results']['channels'][0]['alternatives'][0]['transcript']
-            return transcript.strip() if transcript else "No speech detected"
+            return transcript.strip() if transcript else NO_SPEECH
         else:
             return f"❌ Deepgram Error: {response.status_code}"
             
     except Exception as e:
         return f"❌ Transcription error: {str(e)}"
 
-def transcribe_with_google_cloud(audio_file_path, api_key, language="en-US"):
+def check_deepgram_key(api_key):
+    # Un simple GET authentifié suffit à valider la clé: pas d'audio envoyé,
+    # pas d'inférence facturée.
+    try:
+        response = _http_session().get(
+            "https://api.deepgram.com/v1/projects",
+            headers={"Authorization": f"Token {api_key}"},
+            timeout=5
+        )
+    except requests.RequestException as e:
+        return False, f"❌ Deepgram injoignable: {str(e)}"
+
+    if response.status_code == 200:
+        return True, "✅ Deepgram: Clé valide"
+    if response.status_code == 403:
+        # Clé reconnue mais sans droit de lecture des projets: c'est le cas
+        # des clés limitées à la transcription, qui restent utilisables.
+        return True, "✅ Deepgram: Clé valide, droits insuffisants pour /v1/projects"
+    if response.status_code == 401:
+        return False, "❌ Deepgram: Clé invalide"
+    return False, f"❌ Deepgram Error: {response.status_code}"
+
+def _probe_wav(audio_data):
+    with wave.open(io.BytesIO(audio_data), 'rb') as wav_file:
+        return wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()
+
+def _load_audioop():
+    # audioop est déprécié en 3.11/3.12 et retiré en 3.13, où le paquet
+    # audioop-lts le remplace. Sans lui, les appelants gardent l'audio tel quel.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            import audioop
+        except ImportError:
+            return None
+    return audioop
+
+def _downsample_wav(audio_data, target_rate=16000):
+    # PCM 16 bits mono 16 kHz: le format recommandé et le plus compact en LINEAR16.
+    audioop = _load_audioop()
+    if audioop is None:
+        return None
+    with wave.open(io.BytesIO(audio_data), 'rb') as wav_file:
+        rate, channels, sampwidth = wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if sampwidth == 1:
+        frames = audioop.bias(frames, 1, -128)
+    if sampwidth != 2:
+        frames = audioop.lin2lin(frames, sampwidth, 2)
+    if channels == 2:
+        frames = audioop.tomono(frames, 2, 0.5, 0.5)
+    if rate > target_rate:
+        frames, _ = audioop.ratecv(frames, 2, 1, rate, target_rate, None)
+        rate = target_rate
+    return frames, rate
+
+@st.cache_resource
+def _speech_client(api_key):
+    from google.cloud import speech
+    return speech.SpeechClient(client_options={"api_key": api_key})
+
+def transcribe_with_google_cloud(audio_data, api_key, language="en-US"):
     if not api_key:
         return "❌ Google Cloud API key not configured"
     
     try:
-        import base64
-        with open(audio_file_path, 'rb') as audio_file:
-            audio_content = audio_file.read()
-
-        audio_b64 = base64.b64encode(audio_content).decode('utf-8')
-        url = "https://speech.googleapis.com/v1/speech:recognize"
-        headers = {"Content-Type": "application/json", "X-Goog-Api-Key": api_key}
-        data = {
-            "config": {
-                "encoding": "LINEAR16",
-                "sampleRateHertz": 44100,
-                "languageCode": language,
-                "enableAutomaticPunctuation": True
-            },
-            "audio": {"content": audio_b64}
-        }
+        from google.cloud import speech
+        from google.api_core.exceptions import GoogleAPICallError
+        try:
+            rate, channels, sampwidth = _probe_wav(audio_data)
+        except (wave.Error, EOFError):
+            rate, channels, sampwidth = None, None, None
+
+        audio_content = audio_data
+        if rate and channels <= 2 and (rate > 16000 or channels > 1 or sampwidth != 2):
+            downsampled = _downsample_wav(audio_data)
+            if downsampled:
+                audio_content, rate = downsampled
+                channels = 1
+
+        # Le client gRPC envoie l'audio en protobuf binaire: pas d'encodage base64.
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=rate or 44100,
+            audio_channel_count=channels or 1,
+            language_code=language,
+            enable_automatic_punctuation=True
+        )
+        audio = speech.RecognitionAudio(content=audio_content)
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        try:
+            # retry=None: la politique par défaut rejoue DeadlineExceeded pendant
+            # des minutes, chaque tentative renvoyant (et facturant) l'audio.
+            response = _speech_client(api_key).recognize(config=config, audio=audio, retry=None, timeout=30)
+        except GoogleAPICallError as e:
+            return f"❌ Google Cloud Error: {e.code}"
         
-        if response.status_code == 200:
-            result = response.json()
-            if 'results' in result and result['results']:
-                transcript = result['results'][0]['alternatives'][0]['transcript']
-                return transcript.strip()
-            return "No speech detected"
-        return f"❌ Google Cloud Error: {response.status_code}"
+        if response.results:
+            transcript = response.results[0].alternatives[0].transcript
+            return transcript.strip()
+        return NO_SPEECH
             
     except Exception as e:
         return f"❌ Transcription error: {str(e)}"
 
+def _is_error(result):
+    return not result or result.startswith(ERROR_PREFIXES)
+
+def _is_failure(result):
+    return not result or result.startswith(FAILURE_PREFIX)
+
+TRANSCRIBERS = {
+    "Deepgram": transcribe_with_deepgram,
+    "Google Cloud": transcribe_with_google_cloud,
+}
+
+def cached_transcribe(audio_data, service, api_key, language="en-US"):
+    transcribe = TRANSCRIBERS[service]
+    if os.environ.get("NO_TRANSCRIPT_CACHE") == "1":
+        return transcribe(audio_data, api_key, language)
+
+    digest = hashlib.sha256(audio_data).hexdigest()
+    service_slug = service.lower().replace(" ", "_")
+    cache_path = os.path.join(CACHE_DIR, f"{digest}_{service_slug}_{language}.json")
+
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            return orjson.loads(cache_file.read())["transcript"]
+    except (OSError, orjson.JSONDecodeError, KeyError):
+        pass
+
+    result = transcribe(audio_data, api_key, language)
+    if not _is_error(result):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_path, 'wb') as cache_file:
+                cache_file.write(orjson.dumps({"transcript": result, "status": "ok", "ts": time.time()}))
+        except OSError:
+            pass
+    return result
+
+def _script_executor(max_workers):
+    # Les workers reçoivent le contexte du script: sans lui, chaque appel à
+    # _http_session()/_speech_client() (st.cache_resource) depuis un thread
+    # journalise "missing ScriptRunContext".
+    ctx = get_script_run_ctx()
+
+    def attach_ctx():
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=attach_ctx)
+
+def hedged_transcribe(audio_data, language, deepgram_key, google_key):
+    # Les deux services sont interrogés en parallèle; le premier résultat
+    # exploitable gagne et on n'attend pas le plus lent.
+    executor = _script_executor(2)
+    futures = [
+        executor.submit(cached_transcribe, audio_data, "Deepgram", deepgram_key, language),
+        executor.submit(cached_transcribe, audio_data, "Google Cloud", google_key, language),
+    ]
+    result = None
+    try:
+        for future in as_completed(futures):
+            candidate = future.result()
+            if result is None or _is_failure(result):
+                result = candidate
+            if not _is_error(candidate):
+                result = candidate
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return result
+
+def transcribe_audio(audio_data, service, language, deepgram_key, google_key):
+    if service == RACE_SERVICE:
+        return hedged_transcribe(audio_data, language, deepgram_key, google_key)
+    api_key = deepgram_key if service == "Deepgram" else google_key
+    return cached_transcribe(audio_data, service, api_key, language)
+
+def _wav_duration(audio_data):
+    try:
+        with wave.open(io.BytesIO(audio_data), 'rb') as wav_file:
+            rate = wav_file.getframerate()
+            if not rate:
+                return None
+            return wav_file.getnframes() / rate
+    except (wave.Error, EOFError):
+        return None
+
+def _quietest_frame(frames, frame_size, sampwidth, start, end, window):
+    # Coupe sur la fenêtre la plus silencieuse pour ne pas trancher un mot.
+    audioop = _load_audioop()
+    if audioop is None:
+        return end
+    best, best_rms = end, None
+    for position in range(start, end - window + 1, window):
+        rms = audioop.rms(frames[position * frame_size:(position + window) * frame_size], sampwidth)
+        if best_rms is None or rms < best_rms:
+            best, best_rms = position + window // 2, rms
+    return best
+
+def _split_wav(audio_data, chunk_seconds=CHUNK_SECONDS):
+    stream = io.BytesIO(audio_data)
+    with wave.open(stream, 'rb') as wav_file:
+        params = wav_file.getparams()
+        # wave s'arrête au début du bloc "data": on découpe les trames par
+        # memoryview sur les octets d'origine au lieu de les recopier.
+        data_start = stream.tell()
+
+    frame_size = params.sampwidth * params.nchannels
+    frames = memoryview(audio_data)[data_start:data_start + params.nframes * frame_size]
+    nframes = len(frames) // frame_size
+    chunk_frames = params.framerate * chunk_seconds
+    window = max(params.framerate // 20, 1)
+
+    chunks = []
+    start = 0
+    while start < nframes:
+        end = start + chunk_frames
+        if end >= nframes:
+            end = nframes
+        else:
+            end = _quietest_frame(frames, frame_size, params.sampwidth, end - 2 * params.framerate, end, window)
+        chunk = io.BytesIO()
+        with wave.open(chunk, 'wb') as chunk_file:
+            # En-tête écrit avec la bonne taille dès le départ: pas de retour
+            # en arrière pour corriger la longueur RIFF à la fermeture.
+            chunk_file.setparams(params._replace(nframes=end - start))
+            chunk_file.writeframesraw(frames[start * frame_size:end * frame_size])
+        chunks.append(chunk.getvalue())
+        start = end
+    return chunks
+
+def transcribe_in_chunks(audio_data, service, language, deepgram_key, google_key):
+    chunks = _split_wav(audio_data)
+    with _script_executor(4) as executor:
+        results = list(executor.map(
+            lambda chunk: transcribe_audio(chunk, service, language, deepgram_key, google_key),
+            chunks
+        ))
+
+    errors = [result for result in results if _is_failure(result)]
+    if errors:
+        return errors[0]
+    transcript = " ".join(result for result in results if not _is_error(result))
+    return transcript or NO_SPEECH
+
+def _add_segment(text):
+    st.session_state.segments.append(text)
+    st.session_state.transcription_stale = True
+
+def _clear_segments():
+    st.session_state.segments.clear()
+    st.session_state.transcription_stale = True
+
+def _transcription():
+    # Les segments sont la source de vérité. Le texte affiché et les octets du
+    # téléchargement ne sont assemblés qu'ici, au rendu, et seulement si les
+    # segments ont changé depuis le dernier rendu.
+    if st.session_state.transcription_stale:
+        text = " ".join(st.session_state.segments)
+        st.session_state.transcription = text
+        st.session_state.transcription_bytes = text.encode("utf-8")
+        st.session_state.transcription_stale = False
+    return st.session_state.transcription, st.session_state.transcription_bytes
+
+@st.fragment
+def _results_panel():
+    # Fragment: Effacer/Sauvegarder/Télécharger ne ré-exécutent que ce bloc,
+    # pas les onglets ni la barre latérale.
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("🗑️ Tout effacer", use_container_width=True):
+            _clear_segments()
+    
+    transcription, transcription_bytes = _transcription()
+    
+    with col2:
+        if st.button("💾 Sauvegarder", use_container_width=True):
+            if transcription.strip():
+                filename = f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+                with open(filename, "w", encoding="utf-8") as f:
+                    f.write(transcription.strip())
+                st.success(f"✅ Sauvegardé sous {filename}")
+            else:
+                st.warning("⚠️ Aucune transcription à sauvegarder")
+    
+    with col3:
+        if transcription.strip():
+            st.download_button(
+                label="📥 Télécharger",
+                data=transcription_bytes,
+                file_name=f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
+    st.text_area(
+        "Transcription actuelle:",
+        transcription,
+        height=200,
+        placeholder="Vos transcriptions apparaîtront ici...",
+        key="transcript_display"
+    )
+
 def main():
     st.set_page_config(page_title="Speech Recognition", page_icon="🎙️", layout="wide")
     st.title("🎙️ Speech Recognition App")
     
-    if "transcription" not in st.session_state:
-        st.session_state.transcription = ""
+    if "segments" not in st.session_state:
+        st.session_state.segments = []
+        st.session_state.transcription_stale = True
     
 
     st.sidebar.header("🔑 Configuration API")
@@ -88,6 +412,12 @@ def main():
     st.sidebar.header("🔧 Statut des Services")
     if deepgram_key:
         st.sidebar.success("✅ Deepgram: Configuré")
+        if st.sidebar.button("🔌 Tester Deepgram", use_container_width=True):
+            valid, message = check_deepgram_key(deepgram_key)
+            if valid:
+                st.sidebar.success(message)
+            else:
+                st.sidebar.error(message)
     else:
         st.sidebar.warning("⚠️ Deepgram: Non configuré")
         
@@ -96,6 +426,10 @@ def main():
     else:
         st.sidebar.warning("⚠️ Google Cloud: Non configuré")
     
+    services = ["Deepgram", "Google Cloud"]
+    if deepgram_key and google_key:
+        services.append(RACE_SERVICE)
+    
     # Interface principale avec onglets
     tab1, tab2 = st.tabs(["🎤 Enregistrement Vocal", "📁 Fichier Audio"])
     
@@ -119,29 +453,29 @@ def main():
             with col2:
                 service = st.radio(
                     "Service:",
-                    ["Deepgram", "Google Cloud"],
+                    services,
                     horizontal=True,
                     key="record_service"
                 )
             
+            audio_data = audio_bytes.getvalue()
+            duration = _wav_duration(audio_data)
+            fast_mode = False
+            if duration and duration > 60:
+                fast_mode = st.toggle("Fast mode (parallel chunks)", key="record_fast_mode")
+            
             if st.button("🚀 Transcrire l'enregistrement", use_container_width=True):
                 if (service == "Deepgram" and not deepgram_key) or (service == "Google Cloud" and not google_key):
                     st.error("❌ Clé API manquante pour le service sélectionné")
                 else:
                     with st.spinner("Transcription en cours..."):
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                            tmp_file.write(audio_bytes.getvalue())
-                            tmp_path = tmp_file.name
-                        
-                        if service == "Deepgram":
-                            result = transcribe_with_deepgram(tmp_path, deepgram_key, language)
+                        if fast_mode:
+                            result = transcribe_in_chunks(audio_data, service, language, deepgram_key, google_key)
                         else:
-                            result = transcribe_with_google_cloud(tmp_path, google_key, language)
-                        
-                        os.unlink(tmp_path)
+                            result = transcribe_audio(audio_data, service, language, deepgram_key, google_key)
                         
-                        if result and not any(error in result for error in ["❌", "not configured", "No speech"]):
-                            st.session_state.transcription += " " + result.strip()
+                        if not _is_error(result):
+                            _add_segment(result.strip())
                             st.success("✅ Transcription ajoutée !")
                             st.balloons()
                         else:
@@ -171,29 +505,29 @@ def main():
             with col2:
                 service = st.radio(
                     "Service:",
-                    ["Deepgram", "Google Cloud"],
+                    services,
                     horizontal=True,
                     key="upload_service"
                 )
             
+            audio_data = uploaded_file.getvalue()
+            duration = _wav_duration(audio_data)
+            fast_mode = False
+            if duration and duration > 60:
+                fast_mode = st.toggle("Fast mode (parallel chunks)", key="upload_fast_mode")
+            
             if st.button("🚀 Transcrire le fichier", use_container_width=True):
                 if (service == "Deepgram" and not deepgram_key) or (service == "Google Cloud" and not google_key):
                     st.error("❌ Clé API manquante pour le service sélectionné")
                 else:
                     with st.spinner("Transcription en cours..."):
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                            tmp_file.write(uploaded_file.getvalue())
-                            tmp_path = tmp_file.name
-                        
-                        if service == "Deepgram":
-                            result = transcribe_with_deepgram(tmp_path, deepgram_key, language)
+                        if fast_mode:
+                            result = transcribe_in_chunks(audio_data, service, language, deepgram_key, google_key)
                         else:
-                            result = transcribe_with_google_cloud(tmp_path, google_key, language)
-                        
-                        os.unlink(tmp_path)
+                            result = transcribe_audio(audio_data, service, language, deepgram_key, google_key)
                         
-                        if result and not any(error in result for error in ["❌", "not configured", "No speech"]):
-                            st.session_state.transcription += " " + result.strip()
+                        if not _is_error(result):
+                            _add_segment(result.strip())
                             st.success("✅ Transcription ajoutée !")
                             st.balloons()
                         else:
@@ -201,39 +535,7 @@ def main():
     
     st.header("📝 Résultats de Transcription")
     
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("🗑️ Tout effacer", use_container_width=True):
-            st.session_state.transcription = ""
-            st.rerun()
-    
-    with col2:
-        if st.button("💾 Sauvegarder", use_container_width=True):
-            if st.session_state.transcription.strip():
-                filename = f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                with open(filename, "w", encoding="utf-8") as f:
-                    f.write(st.session_state.transcription.strip())
-                st.success(f"✅ Sauvegardé sous {filename}")
-            else:
-                st.warning("⚠️ Aucune transcription à sauvegarder")
-    
-    with col3:
-        if st.session_state.transcription.strip():
-            st.download_button(
-                label="📥 Télécharger",
-                data=st.session_state.transcription,
-                file_name=f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                use_container_width=True
-            )
-    st.text_area(
-        "Transcription actuelle:",
-        st.session_state.transcription,
-        height=200,
-        placeholder="Vos transcriptions apparaîtront ici...",
-        key="transcript_display"
-    )
+    _results_panel()
     
     with st.expander("ℹ️ Instructions"):
         st.markdown("""